@@ -0,0 +1,31 @@
+import os
+from typing import Any, Hashable, List, Sequence, Tuple
+
+from diskcache import Cache
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Directory of the on-disk cache shared by ingest (READMEs) and the AI providers (embeddings)
+CACHE_DIR = os.getenv("CACHE_DIR", ".cache")
+
+cache = Cache(CACHE_DIR)
+
+
+# diskcache reads and writes SQLite files on disk, so async callers run these helpers
+# with asyncio.to_thread to keep the event loop free
+
+def get_many(keys: Sequence[Hashable]) -> List[Any]:
+    """
+    Looks up several keys at once, returning None for the ones that are not cached.
+    """
+    return [cache.get(key) for key in keys]
+
+def set_many(items: Sequence[Tuple[Hashable, Any]]):
+    """
+    Stores several (key, value) pairs in a single transaction.
+    """
+    with cache.transact():
+        for key, value in items:
+            cache.set(key, value)
@@ -1,10 +1,16 @@
+import atexit
+import io
 import logging
 import os
-from typing import Dict, List
+import threading
+from contextlib import contextmanager
+from typing import List
 
 import psycopg2
+import psycopg2.extensions
 from dotenv import load_dotenv
-from psycopg2.extras import execute_values
+from psycopg2.extras import NamedTupleCursor
+from psycopg2.pool import ThreadedConnectionPool
 
 # Load environment variables
 load_dotenv()
@@ -12,89 +18,183 @@ load_dotenv()
 # Get the database connection URL from the environment variable
 DB_CONNECTION = os.getenv("DB_CONNECTION")
 
-def get_db_connection():
-    """
-    Creates and returns a connection to the PostgreSQL database.
-    """
-    return psycopg2.connect(DB_CONNECTION)
-
-def store_repository(github_username: str, repo_info: Dict):
-    """
-    Stores repository information, README chunks, and their embeddings in the vector database.
-    First checks if repository already exists to avoid duplicates.
-    """
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cur:
-            # Check if repository already exists
-            cur.execute("""
-                SELECT id FROM repositories 
-                WHERE full_name = %s
-            """, (repo_info['full_name'],))
-            
-            existing_repo = cur.fetchone()
-            
-            if existing_repo:
-                logging.info(f"Repository {repo_info['full_name']} already exists, skipping insertion")
-                return existing_repo[0]
-            
-            # Insert repository information if it doesn't exist
-            cur.execute("""
-                INSERT INTO repositories (github_username, name, full_name, readme, description, url, language, stars)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                RETURNING id
-            """, (github_username, repo_info['name'], repo_info['full_name'], repo_info['readme'], repo_info['description'],
-                  repo_info['url'], repo_info['language'], repo_info['stars']))
-            repo_id = cur.fetchone()[0]
- 
-        conn.commit()
-        return repo_id
-    except Exception as e:
-        conn.rollback()
-        raise Exception(f"Error storing repository and embeddings: {str(e)}")
-    finally:
-        conn.close()
+# Bounds for the shared connection pool. The pool closes every returned connection beyond
+# DB_POOL_MIN_CONN, so only that many connections stay open between requests.
+DB_POOL_MIN_CONN = int(os.getenv("DB_POOL_MIN_CONN", "8"))
+DB_POOL_MAX_CONN = int(os.getenv("DB_POOL_MAX_CONN", "16"))
+
+_pool = None
+_pool_lock = threading.Lock()
+# ThreadedConnectionPool raises instead of waiting when it is exhausted, so callers queue here first
+_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX_CONN)
+
+# Statements prepared once per pooled connection, so repeated calls skip parsing and planning
+PREPARED_STATEMENTS = {
+    "store_staged_repositories": """
+        INSERT INTO repositories (github_username, name, full_name, readme, description, url, language, stars)
+        SELECT DISTINCT ON (full_name) github_username, name, full_name, readme, description, url, language, stars
+        FROM repositories_staging
+        ORDER BY full_name
+        ON CONFLICT (full_name) DO UPDATE SET stars = EXCLUDED.stars
+        -- Leave unchanged rows alone so the vectorizer does not queue them again
+        WHERE repositories.stars IS DISTINCT FROM EXCLUDED.stars
+        RETURNING id
+    """,
+    "search_repositories": """
+        SELECT
+            r.name,
+            r.url,
+            r.description,
+            1 - res.distance as similarity_score
+        FROM (
+            -- Embed the query once and let pgvector pick the nearest chunks
+            SELECT
+                id,
+                embedding <=> ai.openai_embed('text-embedding-3-small', $1::text) as distance
+            FROM "public"."repositories_embedding_store"
+            ORDER BY distance
+            LIMIT $2::integer
+        ) res
+        JOIN repositories r ON r.id = res.id
+        ORDER BY res.distance
+    """,
+}
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """
+    Connection that keeps track of the statements already prepared on it.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements = set()
+
+def get_pool() -> ThreadedConnectionPool:
+    """
+    Returns the shared connection pool, creating it on first use.
+    Pooled connections stay open, so queries skip the TCP/TLS/auth handshake.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                logging.info(f"Creating database connection pool ({DB_POOL_MIN_CONN}-{DB_POOL_MAX_CONN} connections)")
+                _pool = ThreadedConnectionPool(DB_POOL_MIN_CONN, DB_POOL_MAX_CONN, dsn=DB_CONNECTION,
+                                               connection_factory=PreparingConnection)
+                atexit.register(_pool.closeall)
+    return _pool
+
+def close_pool():
+    """
+    Closes all pooled connections. A later get_pool() call creates a new pool.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            atexit.unregister(_pool.closeall)
+            _pool.closeall()
+            _pool = None
+
+@contextmanager
+def db_conn():
+    """
+    Checks out a connection from the pool and hands it back when the block exits.
+    Waits for a free connection when all DB_POOL_MAX_CONN are in use.
+    """
+    pool = get_pool()
+    with _pool_slots:
+        conn = pool.getconn()
+        try:
+            yield conn
+        finally:
+            pool.putconn(conn)
+
+def execute_prepared(cur, name: str, params: tuple = ()):
+    """
+    Executes one of PREPARED_STATEMENTS, preparing it first if this connection has not seen it yet.
+    """
+    conn = cur.connection
+    if name not in conn.prepared_statements:
+        cur.execute(f"PREPARE {name} AS {PREPARED_STATEMENTS[name]}")
+        conn.prepared_statements.add(name)
+    if params:
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+    else:
+        cur.execute(f"EXECUTE {name}")
+
+def _csv_value(value) -> str:
+    """
+    Formats a single value for COPY ... WITH (FORMAT csv).
+    Strings are always quoted so that an empty string stays distinct from NULL.
+    """
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        # PostgreSQL text cannot hold NUL characters
+        return '"' + value.replace("\x00", "").replace('"', '""') + '"'
+    return str(value)
+
+def _csv_buffer(rows: List[tuple]) -> io.StringIO:
+    """
+    Serializes rows into an in-memory CSV file that can be streamed to COPY.
+    """
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write(",".join(_csv_value(value) for value in row))
+        buffer.write("\n")
+    buffer.seek(0)
+    return buffer
+
+def store_repositories_bulk(rows: List[tuple]) -> List[int]:
+    """
+    Stores many repositories at once by streaming them into a staging table with COPY.
+    Each row is (github_username, name, full_name, readme, description, url, language, stars).
+    Repositories that already exist only get their star count refreshed.
+    Returns the ids of the inserted rows and of the rows whose star count changed.
+    """
+    if not rows:
+        return []
+    with db_conn() as conn:
+        try:
+            with conn.cursor() as cur:
+                # COPY cannot resolve conflicting rows, so load into a temporary table first.
+                # The table lives as long as the pooled connection and is emptied on every commit,
+                # which keeps the prepared statement reading from it valid across batches.
+                cur.execute("""
+                    CREATE TEMP TABLE IF NOT EXISTS repositories_staging (
+                        github_username TEXT,
+                        name TEXT,
+                        full_name TEXT,
+                        readme TEXT,
+                        description TEXT,
+                        url TEXT,
+                        language TEXT,
+                        stars INTEGER
+                    ) ON COMMIT DELETE ROWS
+                """)
+                cur.copy_expert("""
+                    COPY repositories_staging (github_username, name, full_name, readme, description, url, language, stars)
+                    FROM STDIN WITH (FORMAT csv)
+                """, _csv_buffer(rows))
+                execute_prepared(cur, "store_staged_repositories")
+                stored = cur.fetchall()
+
+            conn.commit()
+            logging.info(f"Stored {len(stored)} new or updated repositories ({len(rows) - len(stored)} unchanged)")
+            return [row[0] for row in stored]
+        except Exception as e:
+            conn.rollback()
+            raise Exception(f"Error storing repositories: {str(e)}")
 
 def search_for_repos(query: str, limit: int = 5):
     """
     Perform semantic search to find relevant repositories.
-    Returns repository information along with similarity scores.
+    Returns (name, url, description, similarity_score) named tuples, most similar first.
     """
-    conn = get_db_connection()
-    try:
-        with conn.cursor() as cur:
+    with db_conn() as conn:
+        with conn.cursor(cursor_factory=NamedTupleCursor) as cur:
             logging.info("Executing semantic search query")
-            # Modified query to return repository metadata along with similarity scores
-            cur.execute("""
-                WITH ranked_results AS (
-                    SELECT 
-                        r.id,
-                        r.name,
-                        r.full_name,
-                        r.description,
-                        r.url,
-                        res.chunk,
-                        res.distance
-                    FROM (
-                        SELECT 
-                            id,
-                            chunk,
-                            embedding <=> ai.openai_embed('text-embedding-3-small', %s) as distance
-                        FROM "public"."repositories_embedding_store"
-                        ORDER BY distance
-                        LIMIT %s
-                    ) res
-                    JOIN repositories r ON r.id = res.id
-                )
-                SELECT 
-                    CONCAT('name: ', name, ' url: ', url, ' content: ', description) as combined_text,
-                    1 - distance as similarity_score
-                FROM ranked_results
-                ORDER BY similarity_score DESC
-            """, (query, limit))
-            
+            execute_prepared(cur, "search_repositories", (query, limit))
+
             results = cur.fetchall()
             logging.info(f"Search query returned {len(results)} results")
             return results
-    finally:
-        conn.close()
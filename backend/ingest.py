@@ -1,11 +1,14 @@
 import asyncio
-import base64
 import logging
+import math
 import os
-from typing import Callable, Dict, List
+import time
+from contextlib import nullcontext
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-import requests
-from db import store_repository
+import aiohttp
+from cache import cache
+from db import store_repositories_bulk
 from dotenv import load_dotenv
 from provider import initialize_ai_provider
 
@@ -14,40 +17,94 @@ load_dotenv()
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Number of repositories buffered before they are written to the database in one statement
+STORE_BATCH_SIZE = 500
 
-async def fetch_and_process_user_stars(github_username: str, send_status: Callable[[Dict], None]) -> Dict:
+GITHUB_API_URL = "https://api.github.com"
+# Media type that makes GitHub return file contents as-is instead of base64 inside JSON
+GITHUB_RAW_MEDIA_TYPE = "application/vnd.github.raw+json"
+
+# Maximum number of GitHub API requests in flight at the same time
+GITHUB_MAX_CONCURRENCY = 64
+# How often a rate limited GitHub request is retried before giving up
+GITHUB_MAX_RETRIES = 5
+
+
+class DynamicAdmission:
+    """
+    Limits the number of concurrent requests, like a semaphore whose limit can be changed at any time.
+    Narrowing the limit lets in-flight requests finish and holds back new ones until they fit again.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+
+    async def release(self):
+        async with self.condition:
+            self.active -= 1
+            self.condition.notify(1)
+
+    async def resize(self, limit: int):
+        if limit == self.limit:
+            return
+        async with self.condition:
+            widened = limit > self.limit
+            self.limit = limit
+            if widened:
+                self.condition.notify_all()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.release()
+
+async def fetch_and_process_user_stars(github_username: str, send_status: Callable[[Dict], None],
+                                       session: Optional[aiohttp.ClientSession] = None) -> Dict:
     """
     Fetches and processes all starred repositories for a given GitHub user.
+    Uses the given GitHub session (see create_github_session), or a session of its own when none is passed.
+    Star pages and READMEs are fetched concurrently, admitted by a DynamicAdmission that starts at
+    GITHUB_MAX_CONCURRENCY and narrows as the GitHub rate limit runs low.
     """
     logging.info(f"Starting to fetch and process starred repositories for user: {github_username}")
-    
+
+    tasks = []
     try:
         processed_repos = []
-        page = 1
+        pending_rows = []
         per_page = 100
-        total_repos = 0
-
-        # First, get the total number of starred repositories
-        api_url = f"https://api.github.com/users/{github_username}/starred?per_page=1"
-        response = requests.get(api_url)
-        response.raise_for_status()
-        total_repos = int(response.headers.get('Link').split(',')[1].split('&page=')[1].split('>')[0])
-
-        while True:
-            api_url = f"https://api.github.com/users/{github_username}/starred?page={page}&per_page={per_page}"
-            logging.info(f"Fetching starred repositories from: {api_url}")
-            response = requests.get(api_url)
-            response.raise_for_status()
+        admission = DynamicAdmission(GITHUB_MAX_CONCURRENCY)
 
-            starred_repos = response.json()
-            if not starred_repos:
-                break
+        async with nullcontext(session) if session else create_github_session() as session:
+            # First, get the total number of starred repositories
+            api_url = f"{GITHUB_API_URL}/users/{github_username}/starred?per_page=1"
+            response, first_page = await github_get(session, api_url, admission)
+            response.raise_for_status()
+            total_repos = count_starred_repos(response, first_page)
 
-            logging.info(f"Processing {len(starred_repos)} repositories on page {page}")
+            # Fetch every page of starred repositories at once
+            page_count = math.ceil(total_repos / per_page)
+            pages = await asyncio.gather(*(
+                fetch_starred_page(session, github_username, page, per_page, admission)
+                for page in range(1, page_count + 1)
+            ))
+            starred_repos = [repo for page in pages for repo in page]
+            logging.info(f"Processing {len(starred_repos)} starred repositories")
 
-            for index, repo in enumerate(starred_repos, 1):
-                repo_name = repo["full_name"]
-                logging.info(f"Processing repository {index + (page-1)*per_page}: {repo_name}")
+            # Fetch all READMEs concurrently and handle each repository as soon as its README arrives
+            tasks = [asyncio.create_task(fetch_repo_info(session, repo, admission)) for repo in starred_repos]
+            for task in asyncio.as_completed(tasks):
+                repo_info = await task
+                repo_name = repo_info["full_name"]
 
                 await send_status({
                     "current_repo": repo_name,
@@ -55,33 +112,22 @@ async def fetch_and_process_user_stars(github_username: str, send_status: Callab
                     "total_count": total_repos
                 })
 
-                readme_content = fetch_readme(repo_name)
-
-
-                repo_info = {
-                    "name": repo["name"],
-                    "full_name": repo_name,
-                    "description": repo["description"],
-                    "readme": readme_content,
-                    "url": repo["html_url"],
-                    "language": repo["language"],
-                    "stars": repo["stargazers_count"],
-                }
-                logging.info(f"Processing: {repo_info}")
-
-
-                if readme_content:
-                    store_repository(github_username, repo_info)
-                    logging.info(f"Processed and stored info for {repo_name}")
+                if repo_info["readme"]:
+                    pending_rows.append((
+                        github_username, repo_info["name"], repo_info["full_name"], repo_info["readme"],
+                        repo_info["description"], repo_info["url"], repo_info["language"], repo_info["stars"]
+                    ))
+                    if len(pending_rows) >= STORE_BATCH_SIZE:
+                        await asyncio.to_thread(store_repositories_bulk, pending_rows)
+                        pending_rows = []
                 else:
                     logging.warning(f"No README found for {repo_name}")
 
                 processed_repos.append(repo_info)
 
-            if 'next' not in response.links:
-                break
-
-            page += 1
+        # Flush whatever is left in the buffer
+        if pending_rows:
+            await asyncio.to_thread(store_repositories_bulk, pending_rows)
 
         logging.info(f"Finished processing all repositories for user: {github_username}")
         await send_status({"status": "COMPLETE"})
@@ -94,25 +140,147 @@ async def fetch_and_process_user_stars(github_username: str, send_status: Callab
 
     except Exception as e:
         logging.error(f"Error processing repositories: {str(e)}")
+        for task in tasks:
+            task.cancel()
         raise
 
-def fetch_readme(repo_full_name: str) -> str:
+def count_starred_repos(response: aiohttp.ClientResponse, first_page: List[Dict]) -> int:
+    """
+    Reads the total number of starred repositories from a starred?per_page=1 response.
+    With one repository per page, the page number of the "last" link is the total count.
+    GitHub omits the Link header when everything fits on the first page.
+    """
+    last_link = response.links.get("last")
+    if last_link is None:
+        return len(first_page)
+    return int(last_link["url"].query["page"])
+
+def create_github_session() -> aiohttp.ClientSession:
+    """
+    Creates the HTTP session shared by all GitHub API calls of an ingest run.
+    Connections are kept alive and reused, and requests are authenticated when GITHUB_TOKEN is set,
+    which raises the rate limit from 60 to 5000 requests per hour.
+    """
+    headers = {"Accept": "application/vnd.github+json"}
+    github_token = os.getenv("GITHUB_TOKEN")
+    if github_token:
+        headers["Authorization"] = f"Bearer {github_token}"
+    else:
+        logging.warning("GITHUB_TOKEN is not set, GitHub API requests are unauthenticated")
+
+    connector = aiohttp.TCPConnector(
+        limit=2 * GITHUB_MAX_CONCURRENCY,
+        limit_per_host=GITHUB_MAX_CONCURRENCY,
+        ttl_dns_cache=300,
+        keepalive_timeout=60
+    )
+    return aiohttp.ClientSession(headers=headers, connector=connector)
+
+async def github_get(session: aiohttp.ClientSession, url: str, admission: DynamicAdmission,
+                     raw: bool = False, etag: Optional[str] = None) -> Tuple[aiohttp.ClientResponse, Optional[Any]]:
+    """
+    Sends a GET request to the GitHub API and returns the response with its decoded JSON body,
+    or with the raw body as text when raw is True.
+    When an etag is given the request is conditional, and GitHub answers 304 if nothing changed.
+    Rate limited requests (403/429) are retried with exponential back-off, honouring Retry-After.
+    """
+    headers = {}
+    if raw:
+        headers["Accept"] = GITHUB_RAW_MEDIA_TYPE
+    if etag:
+        headers["If-None-Match"] = etag
+    for attempt in range(GITHUB_MAX_RETRIES + 1):
+        async with admission:
+            async with session.get(url, headers=headers) as response:
+                if "X-RateLimit-Remaining" in response.headers:
+                    # Never keep more requests in flight than GitHub still allows
+                    remaining = int(response.headers["X-RateLimit-Remaining"])
+                    await admission.resize(max(1, min(GITHUB_MAX_CONCURRENCY, remaining)))
+                if not is_rate_limited(response) or attempt == GITHUB_MAX_RETRIES:
+                    body = None
+                    if response.status == 200:
+                        body = (await response.read()).decode('utf-8', errors='replace') if raw else await response.json()
+                    return response, body
+                delay = retry_delay(response, attempt)
+
+        # Sleep outside the admission so other requests can use the slot meanwhile
+        logging.warning(f"Rate limited by GitHub on {url}, retrying in {delay:.0f}s")
+        await asyncio.sleep(delay)
+
+def is_rate_limited(response: aiohttp.ClientResponse) -> bool:
+    """
+    Tells whether GitHub rejected a request because of its rate limits.
+    """
+    if response.status == 429:
+        return True
+    return response.status == 403 and (
+        "Retry-After" in response.headers or response.headers.get("X-RateLimit-Remaining") == "0"
+    )
+
+def retry_delay(response: aiohttp.ClientResponse, attempt: int) -> float:
+    """
+    Returns how long to wait before retrying a rate limited request.
+    Prefers Retry-After, then waits for X-RateLimit-Reset, and falls back to exponential back-off.
+    """
+    if "Retry-After" in response.headers:
+        return float(response.headers["Retry-After"])
+    if response.headers.get("X-RateLimit-Remaining") == "0" and "X-RateLimit-Reset" in response.headers:
+        return max(float(response.headers["X-RateLimit-Reset"]) - time.time(), 0) + 1
+    return 2 ** attempt
+
+async def fetch_starred_page(session: aiohttp.ClientSession, github_username: str, page: int, per_page: int,
+                             admission: DynamicAdmission) -> List[Dict]:
+    """
+    Fetches a single page of starred repositories for a given GitHub user.
+    """
+    api_url = f"{GITHUB_API_URL}/users/{github_username}/starred?page={page}&per_page={per_page}"
+    logging.info(f"Fetching starred repositories from: {api_url}")
+    response, starred_repos = await github_get(session, api_url, admission)
+    response.raise_for_status()
+    return starred_repos
+
+async def fetch_repo_info(session: aiohttp.ClientSession, repo: Dict, admission: DynamicAdmission) -> Dict:
+    """
+    Fetches the README of a starred repository and collects the information to store.
+    """
+    repo_name = repo["full_name"]
+    readme_content = await fetch_readme(session, repo_name, admission)
+
+    repo_info = {
+        "name": repo["name"],
+        "full_name": repo_name,
+        "description": repo["description"],
+        "readme": readme_content,
+        "url": repo["html_url"],
+        "language": repo["language"],
+        "stars": repo["stargazers_count"],
+    }
+    logging.info(f"Processing: {repo_info}")
+    return repo_info
+
+async def fetch_readme(session: aiohttp.ClientSession, repo_full_name: str, admission: DynamicAdmission) -> str:
     """
     Fetches the README content for a given repository.
+    The README is requested in its raw form, which avoids decoding a base64 copy wrapped in JSON.
     """
     logging.info(f"Fetching README for repository: {repo_full_name}")
+    # Previously fetched READMEs are revalidated with their ETag instead of being downloaded again
+    cache_key = ("readme", repo_full_name)
+    cached = await asyncio.to_thread(cache.get, cache_key)
     try:
-        readme_url = f"https://api.github.com/repos/{repo_full_name}/readme"
-        response = requests.get(readme_url)
-        if response.status_code == 200:
-            content = response.json()["content"]
+        readme_url = f"{GITHUB_API_URL}/repos/{repo_full_name}/readme"
+        response, readme_content = await github_get(session, readme_url, admission, raw=True,
+                                                    etag=cached[0] if cached else None)
+        if response.status == 304 and cached:
+            logging.info(f"README for {repo_full_name} is unchanged, using cached copy")
+            return cached[1]
+        if response.status == 200:
             logging.info(f"Successfully fetched README for {repo_full_name}")
-            return base64.b64decode(content).decode('utf-8')
+            if "ETag" in response.headers:
+                await asyncio.to_thread(cache.set, cache_key, (response.headers["ETag"], readme_content))
+            return readme_content
         logging.warning(f"README not found for {repo_full_name}")
         return None
-    except requests.RequestException as e:
+    except aiohttp.ClientError as e:
         logging.error(f"Error fetching README for {repo_full_name}: {str(e)}")
         return None
-
-
-
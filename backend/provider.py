@@ -1,14 +1,22 @@
+import asyncio
+import hashlib
 import logging
 import os
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional
+from functools import lru_cache, wraps
+from typing import Any, AsyncIterator, Dict, List, Optional
 
+import numpy as np
 import ollama
 import openai
-from openai import OpenAI
+from cache import get_many, set_many
+from openai import AsyncOpenAI, OpenAI
 
 
+# Maximum number of embedding requests sent to Ollama at the same time
+OLLAMA_EMBED_CONCURRENCY = 8
+
 @dataclass
 class ChatMessage:
     role: str
@@ -19,14 +27,44 @@ class ChatResponse:
     message: Dict[str, Optional[str]]  # Changed to match frontend Message type
     raw_response: Any  # Store the original response from the provider
 
+def cache_embeddings(generate_embeddings):
+    """
+    Caches embeddings on disk, keyed by the provider's embedding model and the SHA-256 of each text.
+    Only texts without a cached embedding are sent to the model.
+    """
+    @wraps(generate_embeddings)
+    async def wrapper(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+
+        keys = [("embedding", self.embedding_model, hashlib.sha256(text.encode("utf-8")).hexdigest()) for text in texts]
+        embeddings = await asyncio.to_thread(get_many, keys)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            generated = await generate_embeddings(self, [texts[i] for i in missing])
+            for i, embedding in zip(missing, generated):
+                embeddings[i] = embedding
+            await asyncio.to_thread(set_many, [(keys[i], embeddings[i]) for i in missing])
+        return np.stack(embeddings)
+    return wrapper
+
 class AIProvider(ABC):
     """Abstract base class for AI providers"""
     
     @abstractmethod
-    async def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
-        """Generate embeddings for given texts"""
+    async def generate_embeddings(self, texts: List[str]) -> np.ndarray:
+        """Generate embeddings for given texts as a float32 array of shape (len(texts), dimensions)"""
         pass
-    
+
+    async def generate_embeddings_batched(self, texts: List[str], batch_size: int = 64) -> np.ndarray:
+        """Generate embeddings for many texts, sending them to the provider in batches of batch_size"""
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            batches.append(await self.generate_embeddings(texts[start:start + batch_size]))
+        if not batches:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.concatenate(batches)
+
     @abstractmethod
     async def chat_completion(self, 
                             messages: List[ChatMessage], 
@@ -35,6 +73,14 @@ class AIProvider(ABC):
         """Generate chat completion"""
         pass
 
+    @abstractmethod
+    def chat_completion_stream(self,
+                               messages: List[ChatMessage],
+                               max_tokens: int = 1000,
+                               temperature: float = 0.1) -> AsyncIterator[str]:
+        """Generate chat completion, yielding the content as it is produced"""
+        pass
+
 class OpenAIProvider(AIProvider):
     """OpenAI implementation"""
     
@@ -44,15 +90,23 @@ class OpenAIProvider(AIProvider):
             base_url=base_url,
             default_headers=headers
         )
+        # Streaming uses the async client so waiting for the next chunk does not block the event loop
+        self.async_client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            default_headers=headers
+        )
+        self.embedding_model = "text-embedding-ada-002"
         logging.info("Initialized OpenAI provider")
 
-    async def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+    @cache_embeddings
+    async def generate_embeddings(self, texts: List[str]) -> np.ndarray:
         try:
             response = self.client.embeddings.create(
                 input=texts,
-                model="text-embedding-ada-002"
+                model=self.embedding_model
             )
-            return [data.embedding for data in response.data]
+            return np.asarray([data.embedding for data in response.data], dtype=np.float32)
         except Exception as e:
             logging.error(f"Error generating OpenAI embeddings: {str(e)}")
             raise
@@ -78,24 +132,52 @@ class OpenAIProvider(AIProvider):
             logging.error(f"Error in OpenAI chat completion: {str(e)}")
             raise
 
+    async def chat_completion_stream(self,
+                                     messages: List[ChatMessage],
+                                     max_tokens: int = 1000,
+                                     temperature: float = 0.1) -> AsyncIterator[str]:
+        try:
+            formatted_messages = [{"role": msg.role, "content": msg.content} for msg in messages]
+            stream = await self.async_client.chat.completions.create(
+                model="gpt-3.5-turbo-16k",
+                messages=formatted_messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                n=1,
+                stream=True
+            )
+            async for event in stream:
+                if event.choices and event.choices[0].delta.content:
+                    yield event.choices[0].delta.content
+        except Exception as e:
+            logging.error(f"Error in OpenAI chat completion stream: {str(e)}")
+            raise
+
 class OllamaProvider(AIProvider):
     """Ollama implementation"""
     
     def __init__(self, embedding_model: str = "nomic-embed-text", chat_model: str = "llama3"):
         self.embedding_model = embedding_model
         self.chat_model = chat_model
+        self.async_client = ollama.AsyncClient()
         logging.info(f"Initialized Ollama provider with embedding model {embedding_model} and chat model {chat_model}")
 
-    async def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+    @cache_embeddings
+    async def generate_embeddings(self, texts: List[str]) -> np.ndarray:
         try:
-            embeddings = []
-            for text in texts:
-                response = ollama.embeddings(
-                    model=self.embedding_model,
-                    prompt=text
-                )
-                embeddings.append(response['embedding'])
-            return embeddings
+            # Overlap the requests so the local model can pipeline them, without flooding it
+            semaphore = asyncio.Semaphore(OLLAMA_EMBED_CONCURRENCY)
+
+            async def embed(text: str) -> List[float]:
+                async with semaphore:
+                    response = await self.async_client.embeddings(
+                        model=self.embedding_model,
+                        prompt=text
+                    )
+                    return response['embedding']
+
+            embeddings = await asyncio.gather(*(embed(text) for text in texts))
+            return np.asarray(embeddings, dtype=np.float32)
         except Exception as e:
             logging.error(f"Error generating Ollama embeddings: {str(e)}")
             raise
@@ -105,14 +187,7 @@ class OllamaProvider(AIProvider):
                             max_tokens: int = 1000,
                             temperature: float = 0.1) -> ChatResponse:
         try:
-            # Convert messages to Ollama format
-            formatted_messages = []
-            for msg in messages:
-                if msg.role == "system":
-                    formatted_messages.append({"role": "system", "content": msg.content})
-                else:
-                    formatted_messages.append({"role": "user" if msg.role == "user" else "assistant", 
-                                            "content": msg.content})
+            formatted_messages = self._format_messages(messages)
             
             response = ollama.chat(
                 model=self.chat_model,
@@ -141,6 +216,36 @@ class OllamaProvider(AIProvider):
             logging.error(f"Response structure: {response if 'response' in locals() else 'No response'}")
             raise
 
+    async def chat_completion_stream(self,
+                                     messages: List[ChatMessage],
+                                     max_tokens: int = 1000,
+                                     temperature: float = 0.1) -> AsyncIterator[str]:
+        try:
+            stream = await self.async_client.chat(
+                model=self.chat_model,
+                messages=self._format_messages(messages),
+                stream=True
+            )
+            async for chunk in stream:
+                content = chunk['message'].get('content', '')
+                if content:
+                    yield content
+        except Exception as e:
+            logging.error(f"Error in Ollama chat completion stream: {str(e)}")
+            raise
+
+    @staticmethod
+    def _format_messages(messages: List[ChatMessage]) -> List[Dict[str, str]]:
+        """Convert messages to Ollama format"""
+        formatted_messages = []
+        for msg in messages:
+            if msg.role == "system":
+                formatted_messages.append({"role": "system", "content": msg.content})
+            else:
+                formatted_messages.append({"role": "user" if msg.role == "user" else "assistant",
+                                        "content": msg.content})
+        return formatted_messages
+
 # Factory for creating AI providers
 def create_ai_provider(provider_type: str, **kwargs) -> AIProvider:
     
@@ -182,3 +287,8 @@ def initialize_ai_provider() -> AIProvider:
         )
     else:
         raise ValueError(f"Unsupported AI provider: {provider_type}")
+
+# Shared AI provider, created once so its client and connection pool are reused across requests
+@lru_cache(maxsize=1)
+def get_provider() -> AIProvider:
+    return initialize_ai_provider()
@@ -1,8 +1,9 @@
+import asyncio
 import logging
-from typing import List, Tuple
+from typing import AsyncIterator, List, Optional, Tuple
 
 from db import search_for_repos
-from provider import AIProvider, ChatMessage, initialize_ai_provider
+from provider import AIProvider, ChatMessage, get_provider
 from termcolor import colored
 
 
@@ -10,50 +11,20 @@ def log_step(step: str, message: str):
     """Log a step in the process with a colorized output."""
     logging.info(f"{colored(step, 'blue', attrs=['bold'])}: {message}")
 
+def format_repo_line(repo: Tuple) -> str:
+    """Format a single repository as one markdown line with its link and relevance score."""
+    name, url, description, score = repo
+    return f"[{name}]({url}) - {description or ''} *Relevance: {score*100:.1f}%*"
+
 def format_repo_context(repos: List[Tuple], query: str) -> str:
     """Format repository information into a structured markdown context."""
-    # Start with a header section
-    context = [f"# Your Starred Repositories Related to \"{query}\""]
-    
-    for repo in repos:
-        # The repo tuple contains (combined_text, similarity_score)
-        combined_text, score = repo
-        
-        try:
-            # Split only on the first occurrence of each keyword
-            name_part = combined_text.split('name:', 1)[1].split('url:', 1)[0].strip()
-            url_part = combined_text.split('url:', 1)[1].split('content:', 1)[0].strip()
-            content_part = combined_text.split('content:', 1)[1].strip()
-            
-            # Format as markdown with repository link and relevance score
-            # Keep everything on one line for cleaner presentation
-            context.append(f"[{name_part}]({url_part}) - {content_part} *Relevance: {score*100:.1f}%*")
-            
-        except IndexError:
-            logging.warning(f"Malformed repository entry: {combined_text}")
-    
-    # Add a note about relevance scores at the bottom
-    if context:
-        context.append("\nNote: The relevance scores are based on the similarity of the repository names and descriptions to the query.")
-            
-    return "\n".join(context)
+    # Header section, one line per repository, and a note about relevance scores at the bottom
+    header = f"# Your Starred Repositories Related to \"{query}\""
+    footer = "\nNote: The relevance scores are based on the similarity of the repository names and descriptions to the query."
+    return "\n".join([header, *map(format_repo_line, repos), footer])
 
-async def generate_response(query: str, format_only: bool = False) -> str:
-    """
-    Generate a response for the user's query.
-    If format_only is True, returns just the formatted repository list.
-    Otherwise, provides an AI-enhanced analysis of the repositories.
-    """
-    log_step("RESPONSE", "Generating response based on similar repositories")
-    similar_repos = search_for_repos(query)
-    provider = initialize_ai_provider()
-    # Format the repository context with the query
-    repo_context = format_repo_context(similar_repos, query)
-    
-    # If format_only is True, return just the formatted repository list
-    if format_only:
-        return repo_context
-    
+def build_rag_messages(repo_context: str) -> List[ChatMessage]:
+    """Build the chat messages asking the model to analyze the retrieved repositories."""
     # Create a comprehensive RAG prompt for AI analysis
     system_prompt = """You are a technical assistant specializing in analyzing GitHub repositories.
 Provide concise, structured responses that:
@@ -68,13 +39,34 @@ Provide concise, structured responses that:
 
 Focus on concrete technical details rather than general statements."""
 
-    messages = [
+    return [
         ChatMessage(role="system", content=system_prompt),
         ChatMessage(role="user", content=user_prompt)
     ]
+
+async def retrieve_repo_context(query: str) -> str:
+    """Search for the repositories most similar to the query and format them as markdown context."""
+    log_step("RESPONSE", "Generating response based on similar repositories")
+    similar_repos = await asyncio.to_thread(search_for_repos, query)
+    # Format the repository context with the query
+    return format_repo_context(similar_repos, query)
+
+async def generate_response(query: str, format_only: bool = False, provider: Optional[AIProvider] = None) -> str:
+    """
+    Generate a response for the user's query.
+    If format_only is True, returns just the formatted repository list.
+    Otherwise, provides an AI-enhanced analysis of the repositories,
+    using the given provider or the shared one from get_provider().
+    """
+    repo_context = await retrieve_repo_context(query)
     
+    # If format_only is True, return just the formatted repository list
+    if format_only:
+        return repo_context
+    
+    provider = provider or get_provider()
     response = await provider.chat_completion(
-        messages=messages,
+        messages=build_rag_messages(repo_context),
         max_tokens=1000,  # Reduced for more concise responses
         temperature=0.1   # Keep low for factual responses
     )
@@ -82,3 +74,19 @@ Focus on concrete technical details rather than general statements."""
     logging.info(f"Generated response: {response}")
     
     return response
+
+async def generate_response_stream(query: str, provider: Optional[AIProvider] = None) -> AsyncIterator[str]:
+    """
+    Generate an AI-enhanced analysis of the repositories for the user's query,
+    yielding the text piece by piece as the model produces it.
+    Uses the given provider or the shared one from get_provider().
+    """
+    repo_context = await retrieve_repo_context(query)
+
+    provider = provider or get_provider()
+    async for chunk in provider.chat_completion_stream(
+        messages=build_rag_messages(repo_context),
+        max_tokens=1000,
+        temperature=0.1
+    ):
+        yield chunk
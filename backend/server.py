@@ -3,15 +3,35 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 import logging
-from retrieval import generate_response
-from ingest import fetch_and_process_user_stars
+from retrieval import generate_response, generate_response_stream
+from ingest import create_github_session, fetch_and_process_user_stars
+from provider import get_provider
+from db import close_pool, get_pool
 import json
 import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create the shared clients once at startup instead of per request
+    # The database pool stays the module singleton in db.py, which the query helpers check out from;
+    # opening it here only moves the initial connections to startup
+    await asyncio.to_thread(get_pool)
+    app.state.http_session = create_github_session()
+    app.state.ai_provider = get_provider()
+    logging.info("Created shared database pool, GitHub session and AI provider")
+    try:
+        yield
+    finally:
+        await app.state.http_session.close()
+        await asyncio.to_thread(close_pool)
+        logging.info("Closed shared database pool and GitHub session")
+
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -22,10 +42,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Number of chat exchanges kept in memory, and how many of the latest are returned with a response
+CHAT_HISTORY_SIZE = 50
+CHAT_HISTORY_RESPONSE_SIZE = 20
+
 # In-memory storage for chat history and active WebSocket connections
-chat_history = []
+chat_history = deque(maxlen=CHAT_HISTORY_SIZE)
 active_connections = set()
 
+# Maximum number of status updates waiting to be written to a WebSocket
+STATUS_QUEUE_SIZE = 100
+
+def recent_chat_history():
+    return list(chat_history)[-CHAT_HISTORY_RESPONSE_SIZE:]
+
 class GithubUsername(BaseModel):
     github_username: str
 
@@ -41,23 +71,65 @@ async def websocket_endpoint(websocket: WebSocket):
             data = await websocket.receive_json()
             if 'github_username' in data:
                 await process_github_stars(data['github_username'], websocket)
+            elif 'message' in data:
+                await stream_chat_response(data['message'], websocket)
     except WebSocketDisconnect:
         active_connections.remove(websocket)
 
 async def process_github_stars(github_username: str, websocket: WebSocket):
-    try:
-        async def send_status(status):
-            await websocket.send_json({"status": status})
+    # Status updates are queued and written by a separate task, so ingest never waits on the socket
+    status_queue = asyncio.Queue(maxsize=STATUS_QUEUE_SIZE)
 
+    async def pump_status():
+        connected = True
+        while (status := await status_queue.get()) is not None:
+            if not connected:
+                continue
+            try:
+                await websocket.send_json({"status": status})
+            except Exception as e:
+                # Keep draining the queue so ingest can finish even without a client
+                logging.warning(f"Stopped sending status updates: {str(e)}")
+                connected = False
+
+    async def send_status(status):
+        await status_queue.put(status)
+
+    pump = asyncio.create_task(pump_status())
+    try:
         await send_status({"status": "FETCHING_REPOS"})
-        result = await fetch_and_process_user_stars(github_username, send_status)
+        result = await fetch_and_process_user_stars(github_username, send_status, websocket.app.state.http_session)
+        await status_queue.put(None)
+        await pump
         await websocket.send_json(result)
     except Exception as e:
+        pump.cancel()
         logging.error(f"Error processing user stars: {str(e)}")
         await websocket.send_json({"error": str(e)})
 
+async def stream_chat_response(user_message: str, websocket: WebSocket):
+    # Forward the answer as the model produces it instead of waiting for the full completion
+    try:
+        chunks = []
+        async for chunk in generate_response_stream(user_message, websocket.app.state.ai_provider):
+            chunks.append(chunk)
+            await websocket.send_json({"chunk": chunk})
+
+        assistant_message = "".join(chunks).strip()
+        chat_history.append({
+            "user": user_message,
+            "assistant": assistant_message
+        })
+        await websocket.send_json({
+            "response": assistant_message,
+            "chat_history": recent_chat_history()
+        })
+    except Exception as e:
+        logging.error(f"Error generating response: {str(e)}")
+        await websocket.send_json({"error": str(e)})
+
 @app.post("/ingest")
-async def ingest_stars(github_username: GithubUsername):
+async def ingest_stars(github_username: GithubUsername, request: Request):
     logging.info("Received request to /ingest endpoint")
     if not github_username.github_username:
         logging.warning("No GitHub username provided in the request")
@@ -67,7 +139,11 @@ async def ingest_stars(github_username: GithubUsername):
     
     try:
         logging.info("Calling fetch_and_process_user_stars function")
-        result = await fetch_and_process_user_stars(github_username.github_username, lambda x: None)
+        async def ignore_status(status):
+            pass
+
+        result = await fetch_and_process_user_stars(github_username.github_username, ignore_status,
+                                                    request.app.state.http_session)
         logging.info("Successfully processed user stars")
         return JSONResponse(content={"message": "GitHub user stars processed successfully", "result": result}, status_code=201)
     except Exception as e:
@@ -75,7 +151,7 @@ async def ingest_stars(github_username: GithubUsername):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/chat")
-async def chat(chat_message: ChatMessage):
+async def chat(chat_message: ChatMessage, request: Request):
     logging.info("Received request to /chat endpoint")
     if not chat_message.message:
         logging.warning("No message provided in the chat request")
@@ -85,7 +161,7 @@ async def chat(chat_message: ChatMessage):
     logging.info(f"Received user message: {user_message}")
     
     try:
-        chat_response = await generate_response(user_message)
+        chat_response = await generate_response(user_message, provider=request.app.state.ai_provider)
         # Extract the message content from the ChatResponse object
         assistant_message = chat_response.message['assistant']
         
@@ -96,7 +172,7 @@ async def chat(chat_message: ChatMessage):
         
         return {
             "response": assistant_message,
-            "chat_history": chat_history
+            "chat_history": recent_chat_history()
         }
     except Exception as e:
         logging.error(f"Error generating response: {str(e)}")
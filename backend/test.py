@@ -1,12 +1,15 @@
 import asyncio
+import csv
 import logging
 import os
 from typing import AsyncGenerator, Dict
 
+import numpy as np
 import pytest
 import pytest_asyncio
+from db import _csv_buffer
 from dotenv import load_dotenv
-from ingest import fetch_and_process_user_stars
+from ingest import DynamicAdmission, fetch_and_process_user_stars
 from provider import AIProvider, ChatMessage, create_ai_provider
 from retrieval import generate_response
 from termcolor import colored
@@ -69,13 +72,13 @@ async def test_embeddings(ai_provider: AIProvider):
     
     embeddings = await ai_provider.generate_embeddings(test_texts)
     
-    assert len(embeddings) == len(test_texts)
-    assert all(isinstance(emb, list) for emb in embeddings)
-    assert all(isinstance(val, float) for emb in embeddings for val in emb)
+    assert isinstance(embeddings, np.ndarray)
+    assert embeddings.dtype == np.float32
+    assert embeddings.shape[0] == len(test_texts)
     
     print(colored("✓ Embeddings generated successfully", 'green'))
     print(f"Number of embeddings: {len(embeddings)}")
-    print(f"Embedding dimensions: {len(embeddings[0])}")
+    print(f"Embedding dimensions: {embeddings.shape[1]}")
 
 @pytest.mark.asyncio
 async def test_chat(ai_provider: AIProvider):
@@ -146,5 +149,73 @@ async def test_search_and_chat(ai_provider: AIProvider):
         # Add a small delay between queries
         await asyncio.sleep(2)
 
+def test_csv_buffer():
+    """Test that rows survive the CSV serialization used for COPY"""
+    log_section("Testing CSV Buffer")
+
+    row = ("simonw", 'say "hi"', "a,b", "line one\nline two", "\\N", None, "", 42)
+    buffer = _csv_buffer([row, ("nul\x00byte",)])
+
+    # Strings are quoted, so a literal \N or an empty string never reads back as NULL
+    assert buffer.getvalue() == (
+        '"simonw","say ""hi""","a,b","line one\nline two","\\N",,"",42\n'
+        '"nulbyte"\n'
+    )
+    parsed = list(csv.reader(buffer))
+    assert parsed[0] == ["simonw", 'say "hi"', "a,b", "line one\nline two", "\\N", "", "", "42"]
+    assert parsed[1] == ["nulbyte"]
+
+    print(colored("✓ CSV buffer round-trips quotes, commas, newlines and \\N", 'green'))
+
+@pytest.mark.asyncio
+async def test_admission_resize():
+    """Test that resizing the admission limit bounds the requests in flight"""
+    log_section("Testing Dynamic Admission")
+
+    admission = DynamicAdmission(4)
+    in_flight = 0
+    peak = 0
+    # Admitted requests hold their slot until the current gate opens
+    gate = asyncio.Event()
+
+    async def request():
+        nonlocal in_flight, peak
+        async with admission:
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await gate.wait()
+            in_flight -= 1
+
+    async def settle():
+        for _ in range(50):
+            await asyncio.sleep(0)
+
+    async def open_gate():
+        nonlocal gate
+        opened, gate = gate, asyncio.Event()
+        opened.set()
+        await settle()
+
+    tasks = [asyncio.create_task(request()) for _ in range(12)]
+    await settle()
+    assert in_flight == 4 and peak == 4
+
+    # Narrowing lets the admitted requests finish, then admits no more than the new limit
+    await admission.resize(2)
+    peak = 0
+    await open_gate()
+    assert in_flight == 2 and peak <= 2
+
+    # Widening wakes the waiting requests right away
+    await admission.resize(8)
+    await settle()
+    assert in_flight == 8
+
+    await open_gate()
+    await asyncio.gather(*tasks)
+    assert in_flight == 0 and admission.active == 0
+
+    print(colored("✓ In-flight requests stayed within the admission limit", 'green'))
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v", "--asyncio-mode=auto"])
\ No newline at end of file
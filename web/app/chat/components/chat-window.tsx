@@ -28,36 +28,75 @@ export default function ChatWindow({ user }: { user: any }) {
     }
   }, [chatHistory]);
 
-  const handleSend = async () => {
-    if (input.trim()) {
-      setIsLoading(true);
-      // Add user message immediately
-      setChatHistory((prev) => [...prev, { user: input.trim() }]);
+  const handleSend = () => {
+    const message = input.trim();
+    if (!message) {
+      return;
+    }
+    setIsLoading(true);
+    setInput("");
+    // Add user message immediately
+    setChatHistory((prev) => [...prev, { user: message }]);
 
-      try {
-        const response = await fetch("http://localhost:8000/chat", {
-          method: "POST",
-          headers: {
-            "Content-Type": "application/json",
-          },
-          body: JSON.stringify({ message: input }),
-        });
+    // The answer is streamed over the WebSocket while the model generates it
+    const socket = new WebSocket("ws://localhost:8000/ws");
+    let finished = false;
+
+    const finish = () => {
+      finished = true;
+      setIsLoading(false);
+      socket.close();
+    };
 
-        const data = await response.json();
+    const showError = () => {
+      setChatHistory((prev) => [
+        ...prev,
+        {
+          assistant: "Sorry, there was an error processing your request.",
+        },
+      ]);
+    };
+
+    socket.onopen = () => {
+      socket.send(JSON.stringify({ message }));
+    };
+
+    socket.onmessage = (event) => {
+      const data = JSON.parse(event.data);
+      if (data.chunk !== undefined) {
+        // Append the streamed text to the answer of the latest message
+        setChatHistory((prev) => {
+          const last = prev[prev.length - 1];
+          return [
+            ...prev.slice(0, -1),
+            { ...last, assistant: (last.assistant ?? "") + data.chunk },
+          ];
+        });
+      } else if (data.chat_history) {
         setChatHistory(data.chat_history);
-      } catch (error) {
-        console.error("Error:", error);
-        setChatHistory((prev) => [
-          ...prev,
-          {
-            assistant: "Sorry, there was an error processing your request.",
-          },
-        ]);
-      } finally {
+        finish();
+      } else if (data.error) {
+        console.error("Error:", data.error);
+        showError();
+        finish();
+      }
+    };
+
+    socket.onerror = (error) => {
+      if (finished) {
+        return;
+      }
+      console.error("Error:", error);
+      showError();
+      finish();
+    };
+
+    socket.onclose = () => {
+      if (!finished) {
+        finished = true;
         setIsLoading(false);
-        setInput("");
       }
-    }
+    };
   };
 
   return (
@@ -147,8 +186,8 @@ export default function ChatWindow({ user }: { user: any }) {
               </div>
             ))}
 
-            {/* Loading spinner */}
-            {isLoading && (
+            {/* Loading spinner until the first part of the answer arrives */}
+            {isLoading && !chatHistory[chatHistory.length - 1]?.assistant && (
               <div className="flex items-start justify-start">
                 <div className="flex items-start space-x-3 max-w-[80%]">
                   <Avatar className="h-8 w-8 flex-shrink-0">